@@ -0,0 +1,69 @@
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True)
+def _get_beta(da_x, da_y, db_x, db_y, dab_x, dab_y, beta_max, inv_2sr2, inv_2st2):
+    """ Scalar version of EpidemicDisease.get_beta given the half diagonals and the center offset
+
+    Must stay consistent with the reference EpidemicDisease.get_beta.
+    """
+    angle1 = np.arctan2(-(dab_x * da_x + dab_y * da_y), -dab_y * da_x + dab_x * da_y)
+    angle2 = np.arctan2(dab_x * db_x + dab_y * db_y, dab_y * db_x - dab_x * db_y)
+    r2 = dab_x * dab_x + dab_y * dab_y
+    return beta_max * np.exp(-r2 * inv_2sr2 - (angle1 * angle1 + angle2 * angle2) * inv_2st2)
+
+
+@njit(cache=True, fastmath=True)
+def _geometry(loc):
+    """ Center and half diagonal of a float32 bounding box, computed in float64 """
+    x0, x1 = np.float64(loc[0]), np.float64(loc[2])
+    y0, y1 = np.float64(loc[1]), np.float64(loc[3])
+    return (x0 + x1) / 2, (y0 + y1) / 2, (x0 - x1) / 2, (y0 - y1) / 2
+
+
+@njit(cache=True, fastmath=True)
+def tick_sum_beta(locs, healthy, infectious, beta_max, inv_2sr2, inv_2st2, cutoff_r2, out, sources):
+    """ Total transmission rate towards every healthy subject in one tick
+
+    The infectious subjects are gathered once, so each healthy row only visits them and
+    evaluates _get_beta for the pairs within the cutoff distance. Nothing is allocated,
+    the caller provides both buffers.
+
+    Args:
+        locs: (N, 4) float32 array of bounding boxes, only read for healthy or infectious subjects
+        healthy: (N,) uint8 mask of present, healthy subjects
+        infectious: (N,) uint8 mask of present, infectious subjects
+        beta_max: maximal transmission rate of the epidemic disease
+        inv_2sr2, inv_2st2: 1 / (2 * sigma_r ** 2) and 1 / (2 * sigma_theta ** 2)
+        cutoff_r2: squared distance beyond which pairs are ignored
+        out: (N,) float32 buffer filled with the summed betas, zero for subjects that are not healthy
+        sources: (N,) int64 scratch buffer for the indices of the infectious subjects
+    """
+    n = locs.shape[0]
+    num_sources = 0
+    for j in range(n):
+        if infectious[j]:
+            sources[num_sources] = j
+            num_sources += 1
+
+    out[:] = 0
+    for i in range(n):
+        if healthy[i] == 0:
+            continue
+        ca_x, ca_y, da_x, da_y = _geometry(locs[i])
+        acc = 0.0
+        for k in range(num_sources):
+            cb_x, cb_y, db_x, db_y = _geometry(locs[sources[k]])
+            dab_x, dab_y = cb_x - ca_x, cb_y - ca_y
+            if dab_x * dab_x + dab_y * dab_y <= cutoff_r2:
+                acc += _get_beta(da_x, da_y, db_x, db_y, dab_x, dab_y, beta_max, inv_2sr2, inv_2st2)
+        out[i] = acc
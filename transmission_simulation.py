@@ -1,10 +1,14 @@
 import concurrent.futures
+import math
+import os
+import tempfile
 import numpy as np
 import argparse
 import itertools
-import random
 from enum import IntEnum
 from pathlib import Path
+from typing import TextIO
+from transmission_kernel import HAS_NUMBA, tick_sum_beta
 
 
 class Status(IntEnum):
@@ -12,6 +16,7 @@ class Status(IntEnum):
     INFECTED = 1
     RECOVERED = 2
     VACCINATED = -1
+    EXCLUDED = -2  # not part of the simulated class, e.g. the other half in half class setting
 
 
 def dot_product(a, b):
@@ -23,7 +28,7 @@ class EpidemicDisease(object):
 
     def __init__(
             self, sigma_r: float, sigma_theta: float, conservative_time: int, no_infectious: float,
-            gamma: float, r0: float, nc: float, p_daily: float
+            gamma: float, r0: float, nc: float, p_daily: float, cutoff: float = 5.0
     ):
         self.sigma_r = sigma_r
         self.sigma_theta = sigma_theta
@@ -37,18 +42,31 @@ class EpidemicDisease(object):
         self.rho_daily = self.nc / (np.pi * 2 ** 2) * self.p_daily
         self.beta_max = self.beta_0 / \
             (self.rho_daily * self.sigma_r ** 2 * self.sigma_theta ** 2)
+        self.cutoff = cutoff  # Unit: sigma_r, beyond which the transmission rate is ignored
+        self.cutoff_r2 = (self.cutoff * self.sigma_r) ** 2
+        self._inv_2sr2 = 1.0 / (2 * self.sigma_r ** 2)
+        self._inv_2st2 = 1.0 / (2 * self.sigma_theta ** 2)
 
-    def get_progress_time(self, offset: int):
-        curr_hour = int(round(offset / 3600))  # the unit of offset is second
-        start_infec = curr_hour + self.conservative_time  # hour to be infectious
+    def get_progress_time(self, curr_hour: int, rng: np.random.Generator, size: int = 1):
+        """ Draw the progress times of `size` subjects infected at the same hour
 
-        p = np.random.uniform(0, 1)
-        no_pos_t = int(round(-np.log(p) / (self.gamma * 3600)))
-        no_infec_t = int(round(-np.log(p) / (self.no_infectious * 3600)))
+        Returns:
+            (size, 3) int64 array of the start_infec, stop_infec and recovery_time
+        """
+        # hour to be infectious, rounded up so that start_infec <= curr_hour holds as for the exact value
+        start_infec = math.ceil(curr_hour + self.conservative_time)
+
+        p = 1.0 - rng.random(size)  # uniform on (0, 1]
+        no_pos_t = np.rint(-np.log(p) / (self.gamma * 3600))
+        no_infec_t = np.rint(-np.log(p) / (self.no_infectious * 3600))
         stop_infec = curr_hour + no_infec_t  # hour to be not infectious
         recovery_time = curr_hour + no_pos_t  # hour to recover
 
-        return start_infec, stop_infec, recovery_time  # Unit is hour
+        progress_time = np.empty((size, 3), dtype=np.int64)  # Unit is hour
+        progress_time[:, 0] = start_infec
+        progress_time[:, 1] = stop_infec
+        progress_time[:, 2] = recovery_time
+        return progress_time
 
     @staticmethod
     def _center(loc):
@@ -64,7 +82,7 @@ class EpidemicDisease(object):
 
     @staticmethod
     def _dis(loc_a, loc_b):
-        ds = np.sqrt((loc_a[0] - loc_b[0]) ** 2 + (loc_a[1] - loc_b[1]) ** 2)
+        ds = math.sqrt((loc_a[0] - loc_b[0]) ** 2 + (loc_a[1] - loc_b[1]) ** 2)
         return ds
 
     def get_angle(self, loc_a, loc_b):
@@ -74,53 +92,115 @@ class EpidemicDisease(object):
         da, db = self._dr(loc_a), self._dr(loc_b)
 
         dx, dy = dot_product(d_ab, da), dot_product(t_dab, da)
-        angle1 = np.arctan2(-dx, dy)
+        angle1 = math.atan2(-dx, dy)
 
         dx, dy = dot_product(d_ab, db), dot_product(t_dab, db)
-        angle2 = np.arctan2(dx, -dy)
+        angle2 = math.atan2(dx, -dy)
         return angle1, angle2
 
     def get_beta(self, loc_a, loc_b):
+        """ Transmission rate from the subject at loc_b to the one at loc_a
+
+        Reference implementation of the model, not used by the simulation itself:
+        get_beta_pairs and transmission_kernel._get_beta must give the same result.
+        """
         theta1, theta2 = self.get_angle(loc_a, loc_b)
         r = self._dis(self._center(loc_a), self._center(loc_b))
-        beta = self.beta_max * np.exp(-(r ** 2 / (2 * self.sigma_r ** 2)) -
-                                      (theta1 ** 2 + theta2 ** 2) / (2 * self.sigma_theta ** 2))
+        beta = self.beta_max * math.exp(-r * r * self._inv_2sr2 -
+                                        (theta1 * theta1 + theta2 * theta2) * self._inv_2st2)
         return beta
 
-    def get_transmission_rate(self, t, status_a, status_b, loc_a, loc_b, progress_time_a, progress_time_b):
-        curr_hour = int(round(t / 3600))
-        if status_a == Status.HEALTH and status_b == Status.INFECTED:
-            stop_infec = progress_time_b[1]
-            start_infec = progress_time_b[0]
-            if stop_infec >= curr_hour >= start_infec:
-                b_i, b_j = self.get_beta(loc_a, loc_b), 0
-            else:
-                b_i, b_j = 0, 0
-        elif status_a == Status.INFECTED and status_b == Status.HEALTH:
-            stop_infec = progress_time_a[1]
-            start_infec = progress_time_a[0]
-            if stop_infec >= curr_hour >= start_infec:
-                b_i, b_j = 0, self.get_beta(loc_a, loc_b)
-            else:
-                b_i, b_j = 0, 0
-        else:
-            b_i, b_j = 0, 0
-        return b_i, b_j
+    def get_beta_pairs(self, locs_a, locs_b):
+        """ Vectorized get_beta over the last axis of two broadcastable bounding box arrays
+
+        Must stay consistent with the reference get_beta.
+
+        Args:
+            locs_a: (..., 4) array of bounding boxes of the receiving subjects
+            locs_b: (..., 4) array of bounding boxes of the infectious subjects
+
+        Returns:
+            Array of the broadcast shape where each entry equals get_beta(loc_a, loc_b)
+        """
+        da_x, da_y = (locs_a[..., 0] - locs_a[..., 2]) / 2, (locs_a[..., 1] - locs_a[..., 3]) / 2
+        db_x, db_y = (locs_b[..., 0] - locs_b[..., 2]) / 2, (locs_b[..., 1] - locs_b[..., 3]) / 2
+        dab_x = (locs_b[..., 0] + locs_b[..., 2]) / 2 - (locs_a[..., 0] + locs_a[..., 2]) / 2
+        dab_y = (locs_b[..., 1] + locs_b[..., 3]) / 2 - (locs_a[..., 1] + locs_a[..., 3]) / 2
+
+        angle1 = np.arctan2(-(dab_x * da_x + dab_y * da_y), -dab_y * da_x + dab_x * da_y)
+        angle2 = np.arctan2(dab_x * db_x + dab_y * db_y, dab_y * db_x - dab_x * db_y)
+        r2 = dab_x ** 2 + dab_y ** 2
+        beta = self.beta_max * np.exp(-r2 * self._inv_2sr2 - (angle1 ** 2 + angle2 ** 2) * self._inv_2st2)
+        return beta
+
+    def get_sum_beta(self, locs, healthy, infectious, out=None, sources=None):
+        """ Total transmission rate towards each healthy subject from all the infectious ones
+
+        Pairs further apart than the cutoff distance are skipped. Uses the compiled kernel when
+        numba is available, otherwise get_beta_pairs on the remaining pairs. Both compute in float64.
+
+        Args:
+            out: Optional (N,) float32 buffer reused to hold the result
+            sources: Optional (N,) int64 scratch buffer reused by the compiled kernel
+        """
+        if out is None:
+            out = np.empty(len(locs), dtype=np.float32)
+        if HAS_NUMBA:
+            if sources is None:
+                sources = np.empty(len(locs), dtype=np.int64)
+            tick_sum_beta(locs, healthy.view(np.uint8), infectious.view(np.uint8), self.beta_max,
+                          self._inv_2sr2, self._inv_2st2, self.cutoff_r2, out, sources)
+            return out
+        locs = locs.astype(np.float64)  # Same precision as the compiled kernel
+        healthy, infectious = np.flatnonzero(healthy), np.flatnonzero(infectious)
+        centers = (locs[:, :2] + locs[:, 2:]) / 2
+        d_hi = centers[infectious][None, :] - centers[healthy][:, None]
+        close_h, close_i = np.nonzero((d_hi ** 2).sum(axis=-1) <= self.cutoff_r2)
+        close_h, close_i = healthy[close_h], infectious[close_i]
+        out[:] = np.bincount(close_h, weights=self.get_beta_pairs(locs[close_h], locs[close_i]),
+                             minlength=len(locs))
+        return out
 
 
 class Classroom(object):
     def __init__(
             self, disease: EpidemicDisease, info_path: Path, data_path: Path, output_interval: int,
-            max_sim_days: int, half_class: bool, vaccine_efficacy_rate: float, output_root: Path
+            max_sim_days: int, half_class: bool, vaccine_efficacy_rate: float, output_root: Path,
+            seed: int = None
     ):
         self.disease = disease
         self.teacher_num, self.kid_num = self.load_class_ob_info(info_path)
-        self.location_data = self.load_class_ob_data(data_path)
+        self.location_path, self.present_path = self.cache_class_ob_data(
+            data_path, self.teacher_num + self.kid_num)
+        self._location_data, self._present_bits = None, None
         self.max_simulation_days = max_sim_days
         self.half_class = half_class
         self.vaccine_efficacy_rate = vaccine_efficacy_rate
         self.output_root = output_root
         self.output_interval = output_interval
+        self.seed = seed
+        self._sum_beta = np.zeros(self.teacher_num + self.kid_num, dtype=np.float32)
+        self._sources = np.empty(self.teacher_num + self.kid_num, dtype=np.int64)
+        self._status_fmt = ','.join(['%d'] * (self.num_sim_teachers() + self.num_sim_kids())) + '\n'
+
+    def __getstate__(self):
+        # The memory-mapped observation is reopened by each worker instead of being pickled
+        state = self.__dict__.copy()
+        state['_location_data'], state['_present_bits'] = None, None
+        return state
+
+    @property
+    def location_data(self):
+        if self._location_data is None:
+            self._location_data = np.load(str(self.location_path), mmap_mode='r')
+        return self._location_data
+
+    @property
+    def present_bits(self):
+        """ (T, ceil(N / 8)) presence mask packed along the subjects by np.packbits """
+        if self._present_bits is None:
+            self._present_bits = np.load(str(self.present_path), mmap_mode='r')
+        return self._present_bits
 
     @staticmethod
     def load_class_ob_info(info_path: Path):
@@ -133,25 +213,85 @@ class Classroom(object):
 
     @staticmethod
     def load_class_ob_data(data_path: Path):
-        data = list()
-        location_file = open(str(data_path), 'r')
-        for line in location_file:
-            line = line.strip().split(',')[1:]
-            loc_dict = dict()
-            for i in range(0, len(line), 4):
-                lft_x, lft_y, rht_x, rht_y = map(float, line[i:i + 4])
-                if lft_x != -1 and lft_y != -1 and rht_x != -1 and rht_y != -1:
-                    loc_dict[i // 4] = (lft_x, lft_y, rht_x, rht_y)
-                else:
-                    pass
-            data.append(loc_dict)
-        return data
+        """ Load the classroom observation as a (T, N, 4) location array and a (T, N) presence mask
+
+        The locations of absent subjects are NaN. A blank line is a tick where nobody is present.
+        """
+        with open(str(data_path), 'r') as location_file:
+            lines = location_file.read().splitlines()
+        data = None
+        if all(line.strip() for line in lines):  # np.loadtxt would drop the blank lines
+            try:
+                data = np.loadtxt(lines, delimiter=',', dtype=np.float32, ndmin=2)
+            except ValueError:
+                pass
+        if data is None:
+            # Blank lines or rows of different lengths, pad the short ones with absent subjects
+            rows = [np.array(line.strip().split(',') if line.strip() else [], dtype=np.float32)
+                    for line in lines]
+            width = 1 + 4 * -(-(max(len(row) for row in rows) - 1) // 4)
+            data = np.full((len(rows), width), -1, dtype=np.float32)
+            for i, row in enumerate(rows):
+                data[i, :len(row)] = row
+        locations = data[:, 1:].reshape(len(data), -1, 4)
+        present = (locations != -1).all(axis=-1)
+        locations[~present] = np.nan
+        return locations, present
+
+    @classmethod
+    def cache_class_ob_data(cls, data_path: Path, num_subjects: int):
+        """ Convert the classroom observation to .npy files next to it unless they are up to date
+
+        The observation is trimmed or padded to num_subjects, the subjects missing from the
+        observation are never present.
+
+        Returns:
+            Paths to the (T, N, 4) float32 location array and the bit-packed (T, N) presence mask
+        """
+        location_path = data_path.with_suffix('.locations.npy')
+        present_path = data_path.with_suffix('.present_bits.npy')
+        if not cls._is_cache_valid(data_path, location_path, present_path, num_subjects):
+            locations, present = cls.load_class_ob_data(data_path)
+            num_observed = min(num_subjects, present.shape[1])
+            padded_locations = np.full((len(locations), num_subjects, 4), np.nan, dtype=np.float32)
+            padded_locations[:, :num_observed] = locations[:, :num_observed]
+            locations = padded_locations
+            padded_present = np.zeros((len(present), num_subjects), dtype=bool)
+            padded_present[:, :num_observed] = present[:, :num_observed]
+            present = padded_present
+            # The location file goes last, it is what marks the pair as up to date
+            cls._save_atomic(present_path, np.packbits(present, axis=1))
+            cls._save_atomic(location_path, locations)
+        return location_path, present_path
 
     @staticmethod
-    def _append_status(output_path: Path, status):
-        with open(str(output_path), 'a') as f:
-            f.write('{}\n'.format(
-                ','.join(str(int(status[sub])) for sub in sorted(status))))
+    def _is_cache_valid(data_path: Path, location_path: Path, present_path: Path, num_subjects: int):
+        data_mtime = data_path.stat().st_mtime
+        try:
+            if min(location_path.stat().st_mtime, present_path.stat().st_mtime) < data_mtime:
+                return False
+            locations = np.load(str(location_path), mmap_mode='r')
+            present_bits = np.load(str(present_path), mmap_mode='r')
+        except (OSError, ValueError):
+            # Missing or truncated, e.g. by an interrupted conversion
+            return False
+        return locations.shape[1:] == (num_subjects, 4) and \
+            present_bits.shape == (locations.shape[0], (num_subjects + 7) // 8)
+
+    @staticmethod
+    def _save_atomic(path: Path, array):
+        """ np.save through a temporary file so that other processes never see a partial file """
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _append_status(self, out_file: TextIO, sub_status):
+        out_file.write(self._status_fmt % tuple(sub_status.tolist()))
 
     def kid_indices(self):
         return list(range(self.teacher_num, self.teacher_num + self.kid_num))
@@ -171,103 +311,136 @@ class Classroom(object):
     def class_time(self):
         return len(self.location_data)
 
-    def init_status(self, zero_patient_index: int):
-        status = {zero_patient_index: Status.INFECTED}
+    def compile_kernel(self):
+        """ Run one empty tick so that numba compiles the kernel for the argument types of this classroom
+
+        Called before the workers start, they then load the compiled kernel from numba's disk cache
+        instead of each compiling it again.
+        """
+        nobody = np.zeros(len(self._sum_beta), dtype=bool)
+        self.disease.get_sum_beta(self.location_data[0], nobody, nobody, self._sum_beta, self._sources)
+
+    def init_status(self, zero_patient_index: int, rng: np.random.Generator):
+        status = np.full(self.teacher_num + self.kid_num, Status.EXCLUDED, dtype=np.int8)
+        status[zero_patient_index] = Status.INFECTED
         kids = self.kid_indices()
         kids.remove(zero_patient_index)
-        for kid in random.sample(kids, self.num_sim_kids() - 1):
-            status[kid] = Status.HEALTH
-        for teacher in random.sample(self.teacher_indices(), self.num_sim_teachers()):
-            if np.random.uniform(0.0, 1.0) > self.vaccine_efficacy_rate:
-                status[teacher] = Status.HEALTH
-            else:
-                status[teacher] = Status.VACCINATED
+        status[rng.choice(kids, self.num_sim_kids() - 1, replace=False)] = Status.HEALTH
+        teachers = rng.choice(self.teacher_indices(), self.num_sim_teachers(), replace=False)
+        vaccinated = rng.random(len(teachers)) <= self.vaccine_efficacy_rate
+        status[teachers] = np.where(vaccinated, Status.VACCINATED, Status.HEALTH)
         return status
 
-    def simulate_transmission(self, t, status, loc_dict, progress_time):
-        sum_beta = {sub: 0 for sub in status}
-        for pair in itertools.combinations(status, 2):
-            kid_i, kid_j = pair[0], pair[1]
-            if kid_i in loc_dict and kid_j in loc_dict:
-                beta_i, beta_j = self.disease.get_transmission_rate(
-                    t, status[kid_i], status[kid_j],
-                    loc_dict[kid_i], loc_dict[kid_j],
-                    progress_time[kid_i], progress_time[kid_j]
-                )
-                sum_beta[kid_i] += beta_i
-                sum_beta[kid_j] += beta_j
-
-        for kid in status:
-            if status[kid] == Status.HEALTH:
-                if np.random.uniform(0.0, 1.0) <= sum_beta[kid]:
-                    status[kid] = Status.INFECTED
-                    progress_time[kid] = self.disease.get_progress_time(t)
+    def simulate_transmission(
+            self, curr_hour, status, locs, present, progress_time, rng: np.random.Generator
+    ):
+        start_infec, stop_infec = progress_time[:, 0], progress_time[:, 1]
+        healthy = present & (status == Status.HEALTH)
+        infectious = present & (status == Status.INFECTED) & \
+            (start_infec <= curr_hour) & (curr_hour <= stop_infec)
+
+        sum_beta = self.disease.get_sum_beta(locs, healthy, infectious, self._sum_beta, self._sources)
+
+        new_infected = healthy & (rng.random(len(status)) <= sum_beta)
+        if new_infected.any():
+            status[new_infected] = Status.INFECTED
+            progress_time[new_infected] = self.disease.get_progress_time(
+                curr_hour, rng, np.count_nonzero(new_infected))
 
         return status, progress_time
 
     @staticmethod
     def check_recovery(t, status, progress_time):
-        for sub in status:
-            if status[sub] == Status.INFECTED and progress_time[sub][2] <= t / 3600:
-                status[sub] = Status.RECOVERED
-        return status
+        """ Recover the infected subjects whose recovery time has passed, in place
 
-    def simulate(self, status, out_path: Path):
+        Returns:
+            Whether any subject is still infected
+        """
+        infected = status == Status.INFECTED
+        recovered = infected & (progress_time[:, 2] <= t // 3600)
+        status[recovered] = Status.RECOVERED
+        return (infected & ~recovered).any()
+
+    def simulate(self, status, out_file: TextIO, rng: np.random.Generator):
         """ Simulate the transmission in the classroom based on the given initial condition
 
         Args:
             status: Initial status of the classroom used in the simulation
-            out_path: Path to write the outputs
+            out_file: Opened file to write the outputs
+            rng: Random generator of this simulation
         """
         t = 0
-        progress_time = dict()
-        for sub in status:
-            progress_time[sub] = self.disease.get_progress_time(t)
+        progress_time = np.zeros((self.teacher_num + self.kid_num, 3), dtype=np.int64)
+        subs = status != Status.EXCLUDED
+        progress_time[subs] = self.disease.get_progress_time(0, rng, np.count_nonzero(subs))
 
+        class_time = self.class_time()
         for day in range(1, self.max_simulation_days):
-            # Update the status by daily classroom observation
-            for loc_dict in self.location_data:
+            # Update the status by daily classroom observation, one output interval at a time
+            tick = 0
+            while tick < class_time:
                 if t % self.output_interval == 0:
-                    status = self.check_recovery(t, status, progress_time)
-                    self._append_status(out_path, status)
-                    if Status.INFECTED not in status.values():
+                    has_infected = self.check_recovery(t, status, progress_time)
+                    self._append_status(out_file, status[subs])
+                    if not has_infected:
                         return
-                status, progress_time = self.simulate_transmission(
-                    t, status, loc_dict, progress_time)
-                t += 1
+                next_tick = min(class_time, tick + self.output_interval - t % self.output_interval)
+                for locs, present_bits in zip(self.location_data[tick:next_tick],
+                                              self.present_bits[tick:next_tick]):
+                    present = np.unpackbits(present_bits, count=len(locs)).view(bool)
+                    curr_hour = int(round(t / 3600))
+                    status, progress_time = self.simulate_transmission(
+                        curr_hour, status, locs, present, progress_time, rng)
+                    t += 1
+                tick = next_tick
 
             # Simulate off-class recovery
             if day % 5 == 0:
-                delta_t = 3 * 24 * 3600 - self.class_time()
+                delta_t = 3 * 24 * 3600 - class_time
             else:
-                delta_t = 24 * 3600 - self.class_time()
-            for _ in range(delta_t):
+                delta_t = 24 * 3600 - class_time
+            # No transmission happens off class, so only the output samples need to be visited
+            t_end = t + delta_t
+            while t < t_end:
                 if t % self.output_interval == 0:
-                    status = self.check_recovery(t, status, progress_time)
-                    self._append_status(out_path, status)
-                    if Status.INFECTED not in status.values():
+                    has_infected = self.check_recovery(t, status, progress_time)
+                    self._append_status(out_file, status[subs])
+                    if not has_infected:
                         return
-                t += 1
+                t = min(t_end, t + self.output_interval - t % self.output_interval)
 
     def run_simulation(self, idx):
         zero_patient_index, sim_id = idx
-        status = self.init_status(zero_patient_index)
+        rng = np.random.default_rng(None if self.seed is None else (self.seed, zero_patient_index, sim_id))
+        status = self.init_status(zero_patient_index, rng)
         output_folder = self.output_root / \
             ('half_class' if self.half_class else 'full_class') / \
             'zero_patient_{}'.format(zero_patient_index)
         if not output_folder.exists():
             output_folder.mkdir(parents=True)
         output_path = output_folder / 'simulation{}.csv'.format(sim_id)
-        with open(str(output_path), 'w') as f:
-            f.write(','.join(str(sub) for sub in sorted(status)))
-            f.write('\n')
         print('Start Simulation: Zero Patient {}, Run {}'.format(
             zero_patient_index, sim_id))
-        self.simulate(status, output_path)
+        with open(str(output_path), 'w', buffering=1 << 20) as f:
+            f.write(','.join(str(sub) for sub in np.flatnonzero(status != Status.EXCLUDED)))
+            f.write('\n')
+            self.simulate(status, f, rng)
         print('Finish Simulation: Zero Patient {}, Run {}'.format(
             zero_patient_index, sim_id))
 
 
+# The classroom of a worker process, set once by _init_worker instead of being pickled with every task
+_WORKER = dict()
+
+
+def _init_worker(classroom: Classroom):
+    _WORKER['classroom'] = classroom
+
+
+def _run_simulation(idx):
+    _WORKER['classroom'].run_simulation(idx)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Epidemic Disease Transmission Simulation in the Classroom')
@@ -305,21 +478,32 @@ if __name__ == '__main__':
                         help='Nc of the epidemic disease')
     parser.add_argument('--p_daily', type=float, default=15 / (24 * 60.0),
                         help='p_daily of the epidemic disease')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='The number of worker processes, default to the number of CPUs')
+    parser.add_argument('--cutoff', type=float, default=5.0,
+                        help='The distance in sigma_r beyond which subjects do not infect each other')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed of the random generators, '
+                             'each simulation derives its own stream from it')
     args = parser.parse_args()
 
     covid = EpidemicDisease(
         args.sigma_r, args.sigma_theta, args.conservative_time, args.no_infectious,
-        args.gamma, args.r0, args.nc, args.p_daily
+        args.gamma, args.r0, args.nc, args.p_daily, args.cutoff
     )
     cls = Classroom(
         covid, Path(args.data_path) / args.ob_info, Path(args.data_path) /
         args.ob_data, args.output_interval,
         args.max_simulation_day, args.half_class, args.vaccine_efficacy_rate, Path(
-            args.data_path) / args.output_root
+            args.data_path) / args.output_root, args.seed
     )
-    with concurrent.futures.ProcessPoolExecutor() as executor:
+    cls.compile_kernel()
+    tasks = list(itertools.product(cls.kid_indices(), range(args.num_simulations)))
+    num_workers = args.num_workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(cls,)
+    ) as executor:
+        # About four chunks per worker to cut the IPC per task while keeping the load balanced
         results = executor.map(
-            cls.run_simulation,
-            itertools.product(cls.kid_indices(), list(
-                range(args.num_simulations)))
+            _run_simulation, tasks, chunksize=max(1, len(tasks) // (4 * num_workers))
         )